@@ -1,38 +1,116 @@
 import polars as pl
 import os
-from glob import glob
-from os.path import join
 
 
 def get_combined_full_species_metadata_across_collections(
     base_collections_dir_path: str,
-) -> pl.DataFrame:
+    cache_path: str | None = None,
+) -> pl.LazyFrame:
     """
     Get the full species metadata of all species across all collections of species
     recordings.
 
+    The metadata is returned as a lazy scan over the metadata files, so only the
+    columns and rows needed by the final query are parsed when it is collected.
+
+    When a cache path is given, the combined metadata is stored there as a Parquet
+    file, which is scanned instead of the metadata files for as long as none of the
+    metadata files, nor the directories containing them, have been modified since the
+    cache was written. A directory is modified when entries are added to or removed
+    from it, so added or deleted species and collections also invalidate the cache.
+
+    Parameters
+    ----------
+    base_collections_dir_path : str
+        The path to the directory containing the collections.
+    cache_path : str | None
+        The path of the Parquet file in which to cache the combined metadata. This
+        path must lie outside the base collections directory, as writing the cache
+        would otherwise modify the directories it is checked against. If None, the
+        metadata is not cached.
+
     Returns
     -------
-    pl.DataFrame
+    pl.LazyFrame
         The full species metadata across all collections.
 
+    Raises
+    ------
+    ValueError
+        If the cache path lies inside the base collections directory.
+
     """
 
-    collection_names = os.listdir(base_collections_dir_path)
+    if cache_path is not None and os.path.commonpath(
+        [os.path.abspath(cache_path), os.path.abspath(base_collections_dir_path)]
+    ) == os.path.abspath(base_collections_dir_path):
+        raise ValueError(
+            "The cache path must lie outside the base collections directory. "
+            f"Got: {cache_path}."
+        )
+
+    collection_dir_paths = _get_collection_dir_paths(base_collections_dir_path)
+    species_dir_paths_per_collection = [
+        _get_species_dir_paths(collection_dir_path)
+        for collection_dir_path in collection_dir_paths
+    ]
+    species_metadata_paths_per_collection = [
+        _get_species_metadata_paths(species_dir_paths)
+        for species_dir_paths in species_dir_paths_per_collection
+    ]
+
+    # Use the cached metadata if it is more recent than all metadata files and the
+    # directories containing them. All species directories are checked, including
+    # the ones without a metadata file, so a deleted metadata file is noticed too.
+    if cache_path is not None and os.path.exists(cache_path):
+        source_paths = [base_collections_dir_path, *collection_dir_paths]
+        for species_dir_paths in species_dir_paths_per_collection:
+            source_paths.extend(species_dir_paths)
+        for species_metadata_paths in species_metadata_paths_per_collection:
+            source_paths.extend(species_metadata_paths)
+
+        latest_source_mtime = max(
+            os.path.getmtime(source_path) for source_path in source_paths
+        )
+
+        if os.path.getmtime(cache_path) > latest_source_mtime:
+            return pl.scan_parquet(cache_path)
+
+    # Get the metadata scan for each collection, skipping collections without any
+    # metadata files yet (e.g. a collection that is still being downloaded)
+    full_collections_metadata_list: list[pl.LazyFrame] = [
+        _scan_species_metadata(species_metadata_paths)
+        for species_metadata_paths in species_metadata_paths_per_collection
+        if species_metadata_paths
+    ]
+
+    # Append the collections' chunks without copying them into one contiguous frame
+    full_collections_metadata = pl.concat(
+        full_collections_metadata_list, how="vertical", rechunk=False
+    )
+
+    if cache_path is None:
+        return full_collections_metadata
 
-    # Get the metadata for each collection
-    full_collections_metadata_list: list[pl.DataFrame] = []
-    for collection_name in collection_names:
-        full_collections_metadata_list.append(
-            get_full_species_metadata_for_collection(
-                join(base_collections_dir_path, collection_name)
-            )
+    # Write the combined metadata to a temporary file first and only move it onto the
+    # cache path once it is complete, so an interrupted write never leaves a
+    # truncated cache behind that would be considered up to date
+    temporary_cache_path = cache_path + ".tmp"
+    try:
+        full_collections_metadata.sink_parquet(
+            temporary_cache_path, compression="zstd", statistics=True
         )
+    except BaseException:
+        if os.path.exists(temporary_cache_path):
+            os.remove(temporary_cache_path)
+        raise
 
-    return pl.concat(full_collections_metadata_list)
+    os.replace(temporary_cache_path, cache_path)
 
+    return pl.scan_parquet(cache_path)
 
-def get_full_species_metadata_for_collection(collection_dir_path: str) -> pl.DataFrame:
+
+def get_full_species_metadata_for_collection(collection_dir_path: str) -> pl.LazyFrame:
     """
     Get the full species metadata for a collection of species recordings.
 
@@ -43,36 +121,127 @@ def get_full_species_metadata_for_collection(collection_dir_path: str) -> pl.Dat
 
     Returns
     -------
-    pl.DataFrame
+    pl.LazyFrame
         The full species metadata for the collection.
 
     """
 
-    # Each collection contains multiple species directories
-    species_dirs = os.listdir(collection_dir_path)
+    species_dir_paths = _get_species_dir_paths(collection_dir_path)
 
-    # Remove the unneeded metadata directory
-    species_dirs.remove("metadata")
+    return _scan_species_metadata(_get_species_metadata_paths(species_dir_paths))
 
-    full_species_metadata_list: list[pl.DataFrame] = []
-    for species_dir in species_dirs:
-        # Skip if empty directory
-        if not os.listdir(join(collection_dir_path, species_dir)):
-            continue
 
-        species_metadata_path = glob(
-            join(collection_dir_path, species_dir, "*recording_metadata.csv")
-        )[0]
+def _scan_species_metadata(species_metadata_paths: list[str]) -> pl.LazyFrame:
+    """
+    Scan the recording metadata files of a collection of species recordings.
+
+    Parameters
+    ----------
+    species_metadata_paths : list[str]
+        The paths of the recording metadata files to scan.
+
+    Returns
+    -------
+    pl.LazyFrame
+        The species metadata in the recording metadata files.
+
+    Raises
+    ------
+    ValueError
+        If no recording metadata file paths are given.
+
+    """
+
+    if not species_metadata_paths:
+        raise ValueError("No recording metadata files to scan.")
+
+    # Scan all metadata files at once, so they are parsed in parallel on collect. The
+    # paths are exact, so they must not be expanded as glob patterns.
+    return pl.scan_csv(  # type: ignore
+        species_metadata_paths, infer_schema=False, glob=False
+    )
+
+
+def _get_collection_dir_paths(base_collections_dir_path: str) -> list[str]:
+    """
+    Get the paths of the directories of all collections of species recordings.
+
+    Parameters
+    ----------
+    base_collections_dir_path : str
+        The path to the directory containing the collections.
+
+    Returns
+    -------
+    list[str]
+        The paths of the collection directories.
+
+    """
+
+    with os.scandir(base_collections_dir_path) as base_collections_entries:
+        return [entry.path for entry in base_collections_entries if entry.is_dir()]
+
+
+def _get_species_dir_paths(collection_dir_path: str) -> list[str]:
+    """
+    Get the paths of the directories of all species in a collection of species
+    recordings.
+
+    Parameters
+    ----------
+    collection_dir_path : str
+        The path to the directory containing the collection.
+
+    Returns
+    -------
+    list[str]
+        The paths of the species directories in the collection.
+
+    """
+
+    # Each collection contains multiple species directories, next to the unneeded
+    # metadata directory
+    with os.scandir(collection_dir_path) as collection_entries:
+        return [
+            species_entry.path
+            for species_entry in collection_entries
+            if species_entry.name != "metadata" and species_entry.is_dir()
+        ]
 
-        full_species_metadata_list.append(
-            pl.read_csv(species_metadata_path, infer_schema=False)  # type: ignore
-        )
 
-    return pl.concat(full_species_metadata_list)
+def _get_species_metadata_paths(species_dir_paths: list[str]) -> list[str]:
+    """
+    Get the paths of the recording metadata files in a list of species directories.
+
+    Parameters
+    ----------
+    species_dir_paths : list[str]
+        The paths of the species directories.
+
+    Returns
+    -------
+    list[str]
+        The paths of the recording metadata files in the species directories.
+
+    """
+
+    species_metadata_paths: list[str] = []
+
+    # Each species directory holds a single recording metadata file, while empty
+    # species directories simply yield no metadata file
+    for species_dir_path in species_dir_paths:
+        with os.scandir(species_dir_path) as species_entries:
+            species_metadata_paths.extend(
+                entry.path
+                for entry in species_entries
+                if entry.name.endswith("recording_metadata.csv")
+            )
+
+    return species_metadata_paths
 
 
 def extract_general_metadata_statistics(
-    species_metadata: pl.DataFrame,
+    species_metadata: pl.DataFrame | pl.LazyFrame,
 ) -> dict[str, float]:
     """Extract some general statistics from the species metadata.
 
@@ -112,7 +281,7 @@ def extract_general_metadata_statistics(
     Parameters
     ----------
     species_metadata
-        The species metadata DataFrame.
+        The species metadata DataFrame or LazyFrame.
 
     Returns
     -------
@@ -125,159 +294,76 @@ def extract_general_metadata_statistics(
         species_metadata
     )
 
-    # Use the build-in polars describe method to calculate the general metadata
-    # statistics
-    general_metadata_statistics = per_species_metadata_statistics.describe()
-
-    # Calculate the general metadata statistics
-    general_metadata_statistics = {
-        "total_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "total_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "25th_percentile_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "25%"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "25th_percentile_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "25%"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "avg_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "mean"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "avg_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "mean"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "median_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "50%"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "median_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "50%"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "75th_percentile_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "75%"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "75th_percentile_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "75%"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "max_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "max_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "min_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "min"
-        )
-        .select(pl.col("num_recordings"))
-        .item(),
-        "min_clean_species_recordings": general_metadata_statistics.filter(
-            pl.col("statistic") == "min"
-        )
-        .select(pl.col("num_clean_recordings"))
-        .item(),
-        "total_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "total_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-        "25th_percentile_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "25%"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "25th_percentile_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "25%"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-        "avg_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "mean"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "avg_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "mean"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-        "median_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "50%"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "median_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "50%"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-        "75th_percentile_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "75%"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "75th_percentile_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "75%"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-        "max_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "max_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "max"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-        "min_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "min"
-        )
-        .select(pl.col("total_recording_length"))
-        .item(),
-        "min_clean_species_recording_length": general_metadata_statistics.filter(
-            pl.col("statistic") == "min"
-        )
-        .select(pl.col("total_clean_recording_length"))
-        .item(),
-    }
-
-    return general_metadata_statistics
+    # Calculate all general metadata statistics in a single selection. Percentiles
+    # (and the median) use the "nearest" interpolation, like polars' describe method.
+    general_metadata_statistics = per_species_metadata_statistics.select(
+        pl.col("num_recordings").sum().alias("total_species_recordings"),
+        pl.col("num_clean_recordings").sum().alias("total_clean_species_recordings"),
+        pl.col("num_recordings")
+        .quantile(0.25, interpolation="nearest")
+        .alias("25th_percentile_species_recordings"),
+        pl.col("num_clean_recordings")
+        .quantile(0.25, interpolation="nearest")
+        .alias("25th_percentile_clean_species_recordings"),
+        pl.col("num_recordings").mean().alias("avg_species_recordings"),
+        pl.col("num_clean_recordings").mean().alias("avg_clean_species_recordings"),
+        pl.col("num_recordings")
+        .quantile(0.5, interpolation="nearest")
+        .alias("median_species_recordings"),
+        pl.col("num_clean_recordings")
+        .quantile(0.5, interpolation="nearest")
+        .alias("median_clean_species_recordings"),
+        pl.col("num_recordings")
+        .quantile(0.75, interpolation="nearest")
+        .alias("75th_percentile_species_recordings"),
+        pl.col("num_clean_recordings")
+        .quantile(0.75, interpolation="nearest")
+        .alias("75th_percentile_clean_species_recordings"),
+        pl.col("num_recordings").max().alias("max_species_recordings"),
+        pl.col("num_clean_recordings").max().alias("max_clean_species_recordings"),
+        pl.col("num_recordings").min().alias("min_species_recordings"),
+        pl.col("num_clean_recordings").min().alias("min_clean_species_recordings"),
+        pl.col("total_recording_length").sum().alias("total_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .sum()
+        .alias("total_clean_species_recording_length"),
+        pl.col("total_recording_length")
+        .quantile(0.25, interpolation="nearest")
+        .alias("25th_percentile_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .quantile(0.25, interpolation="nearest")
+        .alias("25th_percentile_clean_species_recording_length"),
+        pl.col("total_recording_length").mean().alias("avg_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .mean()
+        .alias("avg_clean_species_recording_length"),
+        pl.col("total_recording_length")
+        .quantile(0.5, interpolation="nearest")
+        .alias("median_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .quantile(0.5, interpolation="nearest")
+        .alias("median_clean_species_recording_length"),
+        pl.col("total_recording_length")
+        .quantile(0.75, interpolation="nearest")
+        .alias("75th_percentile_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .quantile(0.75, interpolation="nearest")
+        .alias("75th_percentile_clean_species_recording_length"),
+        pl.col("total_recording_length").max().alias("max_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .max()
+        .alias("max_clean_species_recording_length"),
+        pl.col("total_recording_length").min().alias("min_species_recording_length"),
+        pl.col("total_clean_recording_length")
+        .min()
+        .alias("min_clean_species_recording_length"),
+    ).cast(pl.Float64)
+
+    return general_metadata_statistics.row(0, named=True)
 
 
 def extract_per_species_metadata_statistics(
-    species_metadata: pl.DataFrame,
+    species_metadata: pl.DataFrame | pl.LazyFrame,
 ) -> pl.DataFrame:
     """Extract some per-species statistics from the species metadata.
 
@@ -294,7 +380,7 @@ def extract_per_species_metadata_statistics(
     Parameters
     ----------
     species_metadata
-        The species metadata DataFrame.
+        The species metadata DataFrame or LazyFrame.
 
     Returns
     -------
@@ -302,51 +388,37 @@ def extract_per_species_metadata_statistics(
         The extracted per-species statistics.
     """
 
-    # Count the number of recordings per species
-    num_recordings_per_species = species_metadata.group_by(pl.col("english_name")).agg(
-        pl.len().alias("num_recordings")
-    )
-
-    # Calculate the total recording duration per species
-    total_duration_per_species = species_metadata.group_by(pl.col("english_name")).agg(
-        pl.duration(
-            minutes=pl.col("recording_length").str.split(":").list.get(0),
-            seconds=pl.col("recording_length").str.split(":").list.get(1),
+    # Parse the recording length (in "minutes:seconds" format) into seconds once and
+    # flag the "clean" recordings
+    species_metadata = (
+        species_metadata.lazy()
+        .with_columns(
+            recording_length_parts=pl.col("recording_length")
+            .str.split_exact(":", 1)
+            .struct.rename_fields(["minutes", "seconds"]),
+            is_clean=pl.col("background_species") == "[]",
+        )
+        .with_columns(
+            recording_length_seconds=pl.col("recording_length_parts")
+            .struct.field("minutes")
+            .cast(pl.Int64)
+            * 60
+            + pl.col("recording_length_parts").struct.field("seconds").cast(pl.Int64)
         )
-        .dt.total_seconds()
-        .alias("total_recording_length")
-        .sum()
     )
 
-    # Count the number of "clean" recordings per species
-    num_clean_recordings_per_species = (
-        species_metadata.filter(pl.col("background_species") == "[]")
-        .group_by(pl.col("english_name"))
-        .agg(pl.len().alias("num_clean_recordings"))
-    )
-
-    # Calculate the total recording duration per species
-    total_clean_duration_per_species = (
-        species_metadata.filter(pl.col("background_species") == "[]")
-        .group_by(pl.col("english_name"))
-        .agg(
-            pl.duration(
-                minutes=pl.col("recording_length").str.split(":").list.get(0),
-                seconds=pl.col("recording_length").str.split(":").list.get(1),
-            )
-            .dt.total_seconds()
-            .alias("total_clean_recording_length")
-            .sum()
-        )
-    )
-
-    # Merge the metadata characteristics into a single DataFrame
-    metadata_characteristics = (
-        num_recordings_per_species.join(
-            num_clean_recordings_per_species, on="english_name", how="left"
-        )
-        .join(total_duration_per_species, on="english_name", how="left")
-        .join(total_clean_duration_per_species, on="english_name", how="left")
+    # Calculate all per-species statistics in a single aggregation. Species without
+    # any "clean" recordings get null "clean" statistics.
+    has_clean_recordings = pl.col("is_clean").any()
+    metadata_characteristics = species_metadata.group_by(pl.col("english_name")).agg(
+        pl.len().alias("num_recordings"),
+        pl.when(has_clean_recordings)
+        .then(pl.col("is_clean").sum())
+        .alias("num_clean_recordings"),
+        pl.col("recording_length_seconds").sum().alias("total_recording_length"),
+        pl.when(has_clean_recordings)
+        .then(pl.col("recording_length_seconds").filter(pl.col("is_clean")).sum())
+        .alias("total_clean_recording_length"),
     )
 
-    return metadata_characteristics.sort("english_name")
+    return metadata_characteristics.sort("english_name").collect()
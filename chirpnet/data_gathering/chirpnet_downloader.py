@@ -1,15 +1,21 @@
 from cantopy import Query, FetchManager, DownloadManager
-import pandas as pd
+from chirpnet.config import Config
+import polars as pl
 from os import path
+import csv
 import os
 import shutil
 from prefect import flow, task  # type: ignore
+from prefect.futures import as_completed  # type: ignore
+from prefect.task_runners import ThreadPoolTaskRunner  # type: ignore
 
 
 class ChirpNetDownloader:
 
     @classmethod
-    @flow
+    @flow(
+        task_runner=ThreadPoolTaskRunner(max_workers=Config.DOWNLOADER_MAX_WORKERS)
+    )
     def download_species_data(
         cls,
         species_list_path: str,
@@ -20,6 +26,9 @@ class ChirpNetDownloader:
     ) -> None:
         """Download the XenoCanto recording data for a list of species.
 
+        The species are downloaded concurrently, using at most
+        `Config.DOWNLOADER_MAX_WORKERS` workers.
+
         Parameters
         ----------
         species_list_path
@@ -52,7 +61,7 @@ class ChirpNetDownloader:
             f"Starting species data download for year: {recorded_year}, quality: {quality}, max_pages: {max_pages} ..."
         )
 
-        download_manager, download_folder_path = cls._initialize_download_manager(
+        download_folder_path = cls._initialize_download_folder(
             species_list_path,
             recorded_year,
             quality,
@@ -60,49 +69,82 @@ class ChirpNetDownloader:
             downloader_base_path,
         )
 
-        cls._initialize_metadata(species_list_path, download_folder_path)
+        metadata_folder_path = path.join(download_folder_path, "metadata")
+        already_downloaded_folder_path = path.join(
+            metadata_folder_path, "already_downloaded"
+        )
+
+        cls._initialize_metadata(
+            species_list_path, metadata_folder_path, already_downloaded_folder_path
+        )
+
+        # Load only the common names of the species from the species list
+        species_list = pl.read_csv(  # type: ignore
+            species_list_path, columns=["Common Name"], infer_schema=False
+        )["Common Name"].to_list()
 
-        # Load the species list and extract only the common names of the species
-        species_list = pd.read_csv(species_list_path, index_col=None)[  # type: ignore
-            "Common Name"
-        ].values.tolist()
+        # Load the already downloaded species once, so that the download loop does
+        # not have to re-check the metadata folder for every species
+        already_downloaded_species = cls._load_already_downloaded_species(
+            already_downloaded_folder_path
+        )
 
         # Filter out the already downloaded species
         species_list = cls._filter_already_downloaded_species(
-            species_list, download_folder_path  # type: ignore
+            species_list, already_downloaded_species  # type: ignore
         )
 
         print(f"Downloading data for {len(species_list)} species ...")
 
-        # Download the data for each species in the list
-        for species_name in species_list:
-
-            cls._download_single_species_data(
-                download_manager, species_name, recorded_year, quality, max_pages
+        # Download the data for the species in the list concurrently, marking each
+        # finished species in the already-downloaded metadata folder
+        download_futures = {
+            cls._download_single_species_data.submit(
+                download_folder_path, species_name, recorded_year, quality, max_pages
+            ): species_name
+            for species_name in species_list
+        }
+
+        # Wait for every download, so a failed species does not prevent the species
+        # that finish after it from being marked as downloaded
+        failed_species: list[str] = []
+        for download_future in as_completed(download_futures):
+            species_name = download_futures[download_future]
+
+            try:
+                download_future.result()
+            except Exception as e:
+                print(f"Download failed for species: {species_name}: {e}")
+                failed_species.append(species_name)
+                continue
+
+            cls._update_already_downloaded_metadata(
+                species_name, already_downloaded_folder_path
             )
 
-            cls._update_already_downloaded_metadata(species_name, download_folder_path)
+        if failed_species:
+            raise RuntimeError(
+                f"Download failed for {len(failed_species)} species: "
+                f"{', '.join(failed_species)}."
+            )
 
         print("Download complete.")
 
     @staticmethod
     @task
-    def _initialize_download_manager(
+    def _initialize_download_folder(
         species_list_path: str,
         recorded_year: int,
         quality: str,
         max_pages: int,
         downloader_base_path: str,
-    ) -> tuple[DownloadManager, str]:
-        """Initialize a download manager instance for a species list download request.
-
-        This download manager instance will be used to download the recording data for
-        the species in the species list.
+    ) -> str:
+        """Initialize the download folder for a species list download request.
 
-        The download manager's base path will be set to a subfolder of the
-        ChirpNetDownloader's base path with the subfolder's name set to the specific
-        species list, year and quality for which to download recording data, in the
-        format: <species_list_name>_y<year>_q<quality>_mp<max_pages>.
+        The download folder is a subfolder of the ChirpNetDownloader's base path with
+        the subfolder's name set to the specific species list, year and quality for
+        which to download recording data, in the format:
+        <species_list_name>_y<year>_q<quality>_mp<max_pages>.
 
         Parameters
         ----------
@@ -120,15 +162,13 @@ class ChirpNetDownloader:
 
         Returns
         -------
-        DownloadManager
-            The initialized download manager instance.
         str
             The folder path where the downloaded data will be stored for the
             specific species list query.
 
         """
 
-        print("Initializing download manager ...")
+        print("Initializing download folder ...")
 
         species_list_name = path.basename(species_list_path).split(".")[0]
 
@@ -137,61 +177,107 @@ class ChirpNetDownloader:
         )
 
         download_folder_path = path.join(downloader_base_path, download_folder_name)
-        if not path.exists(download_folder_path):
-            os.mkdir(download_folder_path)
+        os.makedirs(download_folder_path, exist_ok=True)
 
-        return DownloadManager(download_folder_path), download_folder_path
+        return download_folder_path
 
     @staticmethod
     @task
     def _initialize_metadata(
         species_list_path: str,
-        download_folder_path: str,
+        metadata_folder_path: str,
+        already_downloaded_folder_path: str,
     ):
         """Initialize a metadata folder for a species list download request.
 
         The metadata folder contains the following files:
         - species_list.csv: The list of species for which data is being downloaded.
-        - already_downloaded.csv: A CSV file containing the names of the species for
-            which data has already been downloaded.
+        - already_downloaded/: A folder containing an empty `<species_name>.ok` marker
+            file for each species for which data has already been downloaded.
+
+        The already_downloaded folder is also created for existing metadata folders
+        that do not have one yet. If such a metadata folder still contains a legacy
+        already_downloaded.csv file, its species are converted to marker files.
 
         Parameters
         ----------
         species_list_path
             The path to the CSV file containing the list of species to download.
-        download_folder_path
-            The folder path where the downloaded data will be stored for the species
-            list download request.
+        metadata_folder_path
+            The path of the metadata folder of the species list download request.
+        already_downloaded_folder_path
+            The path of the already_downloaded folder in the metadata folder.
 
         """
 
         print("Initializing metadata folder ...")
 
-        metadata_folder_path = path.join(download_folder_path, "metadata")
-
-        if path.exists(metadata_folder_path):
-            print("Metadata folder already exists. Skipping initialization.")
-            return
+        try:
+            os.makedirs(metadata_folder_path)
+        except FileExistsError:
+            print("Metadata folder already exists. Skipping species list copy.")
+        else:
+            # Copy the species list to the metadata folder
+            species_list_name = path.basename(species_list_path).split(".")[0]
+            shutil.copy(
+                species_list_path,
+                path.join(metadata_folder_path, f"{species_list_name}.csv"),
+            )
 
-        os.mkdir(metadata_folder_path)
+        # Create the already_downloaded folder, in which a marker file is created for
+        # each downloaded species
+        os.makedirs(already_downloaded_folder_path, exist_ok=True)
 
-        # Copy the species list to the metadata folder
-        species_list_name = path.basename(species_list_path).split(".")[0]
-        shutil.copy(
-            species_list_path,
-            path.join(metadata_folder_path, f"{species_list_name}.csv"),
+        # Convert the species of a legacy already_downloaded.csv file to marker files
+        legacy_already_downloaded_path = path.join(
+            metadata_folder_path, "already_downloaded.csv"
         )
+        if path.exists(legacy_already_downloaded_path):
+            print("Converting legacy already_downloaded.csv to marker files ...")
 
-        # Create the already_downloaded.csv file
-        pd.DataFrame(columns=["Species"]).to_csv(
-            path.join(metadata_folder_path, "already_downloaded.csv"), index=False
-        )
+            with open(legacy_already_downloaded_path, newline="") as f:
+                for row in csv.DictReader(f):
+                    marker_file_name = f"{row['Species']}.ok"
+                    open(
+                        path.join(already_downloaded_folder_path, marker_file_name), "a"
+                    ).close()
+
+            # Only remove the legacy file once all of its species have been converted
+            os.remove(legacy_already_downloaded_path)
+
+    @staticmethod
+    @task
+    def _load_already_downloaded_species(
+        already_downloaded_folder_path: str,
+    ) -> set[str]:
+        """Load the names of the species that have already been downloaded for a
+        species list download request.
+
+        Parameters
+        ----------
+        already_downloaded_folder_path
+            The path to the already_downloaded metadata folder of the species list
+            download request.
+
+        Returns
+        -------
+        set[str]
+            The names of the species that have already been downloaded.
+
+        """
+
+        print("Loading already downloaded species ...")
+
+        return {
+            marker_file_name.removesuffix(".ok")
+            for marker_file_name in os.listdir(already_downloaded_folder_path)
+        }
 
     @staticmethod
     @task
     def _filter_already_downloaded_species(
         species_list: list[str],
-        download_folder_path: str,
+        already_downloaded_species: set[str],
     ) -> list[str]:
         """Filter out the species that have already been downloaded for a species list
         download request.
@@ -200,9 +286,8 @@ class ChirpNetDownloader:
         ----------
         species_list
             The list of species to filter.
-        download_folder_path
-            The folder path where the downloaded data is stored for the species list
-            download request.
+        already_downloaded_species
+            The names of the species that have already been downloaded.
 
         Returns
         -------
@@ -213,27 +298,16 @@ class ChirpNetDownloader:
 
         print("Filtering out already downloaded species ...")
 
-        metadata_folder_path = path.join(download_folder_path, "metadata")
-
-        # Load the already downloaded species metadata
-        already_downloaded_path = path.join(
-            metadata_folder_path, "already_downloaded.csv"
-        )
-        already_downloaded = pd.read_csv(already_downloaded_path, index_col=None)  # type: ignore
-        already_downloaded_species = already_downloaded["Species"].values.tolist()  # type: ignore
-
-        # Filter out the already downloaded species
-        return list(
-            filter(
-                lambda species: species not in already_downloaded_species,
-                species_list,
-            )
-        )
+        return [
+            species
+            for species in species_list
+            if species not in already_downloaded_species
+        ]
 
     @staticmethod
     @task
     def _download_single_species_data(
-        download_manager: DownloadManager,
+        download_folder_path: str,
         species_name: str,
         recorded_year: int,
         quality: str,
@@ -243,8 +317,9 @@ class ChirpNetDownloader:
 
         Parameters
         ----------
-        download_manager
-            The download manager instance to use for downloading the data.
+        download_folder_path
+            The folder path where the downloaded data is stored for the species list
+            download request.
         species_name
             The name of the species to download.
         recorded_year
@@ -276,40 +351,35 @@ class ChirpNetDownloader:
         )
         print(f"Downloading recordings data for species: {species_name} ...")
 
-        # Download the data contained in the query result
+        # Download the data contained in the query result. Each download task uses its
+        # own download manager, as cantopy's download manager is not known to be
+        # thread-safe.
+        download_manager = DownloadManager(download_folder_path)
         download_manager.download_all_recordings_in_queryresult(query_result)
 
     @staticmethod
     @task
     def _update_already_downloaded_metadata(
         species_name: str,
-        download_folder_path: str,
+        already_downloaded_folder_path: str,
     ) -> None:
-        """Update the already-downloaded metadata file for a species list download
+        """Update the already-downloaded metadata folder for a species list download
         request.
 
+        An empty `<species_name>.ok` marker file is created for the species, so no
+        metadata file ever has to be re-read or rewritten, and concurrent updates
+        cannot interfere with each other.
+
         Parameters
         ----------
         species_name
             The name of the species for which data has been downloaded.
-        download_folder_path
-            The folder path where the downloaded data is stored for the species list
+        already_downloaded_folder_path
+            The path to the already_downloaded metadata folder of the species list
             download request.
 
         """
 
-        metadata_folder_path = path.join(download_folder_path, "metadata")
-
-        # Load the already downloaded metadata
-        already_downloaded_path = path.join(
-            metadata_folder_path, "already_downloaded.csv"
-        )
-        already_downloaded = pd.read_csv(already_downloaded_path, index_col=None)  # type: ignore
-
-        # Add the species name to the already downloaded metadata
-        already_downloaded = pd.concat(
-            [already_downloaded, pd.DataFrame({"Species": [species_name]})],
-            ignore_index=True,
-        )
-
-        already_downloaded.to_csv(already_downloaded_path, index=False)
+        open(
+            path.join(already_downloaded_folder_path, f"{species_name}.ok"), "a"
+        ).close()
@@ -1,6 +1,4 @@
-from prefect import flow  # type: ignore
-from chirpnet.cli import download_species_data
-
-
 if __name__ == "__main__":
+    from chirpnet.cli import download_species_data
+
     download_species_data.serve(name="local_chirpnet_data_download") # type: ignore